@@ -2,23 +2,175 @@
 import sys
 import os
 import io
+import re
 import logging
+import queue
+import atexit
 import argparse
 import zipfile
 import tempfile
-import base64
 import shutil
 import requests
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-from xml.etree import ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from email.message import EmailMessage
+try:
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+from urllib3.util.retry import Retry
 from urllib.parse import quote
+from xml.sax.saxutils import escape
 import glsapiutil3
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+# Email templates are loaded from the templates folder next to this script; the
+# environment caches each compiled template, so they are only read and parsed once
+TEMPLATE_ENV = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False
+)
+
+# Extra entities needed when escaping text for use inside a double-quoted XML attribute
+XML_ATTR_ENTITIES = {'"': '&quot;'}
+
+# Maximum number of project zip uploads to run at the same time
+MAX_UPLOAD_WORKERS = 8
+
+# Maximum number of artifact project lookups to run at the same time
+MAX_LOOKUP_WORKERS = 16
+
+# Size of the HTTP connection pool shared by all Clarity requests
+HTTP_POOL_SIZE = 16
+
+# Buffer size used for the downloaded zip file and for copying zip members
+ZIP_IO_BUFFER_SIZE = 1 << 20
+
+# Project zips up to this size are kept in memory; larger ones spill to a temp file
+ZIP_SPOOL_MAX_SIZE = 64 << 20
+
+# Text sidecar files that compress well; everything else (e.g. .ab1 traces) is stored as-is
+DEFLATED_EXTENSIONS = {'.txt', '.seq', '.fasta', '.fa', '.qual'}
+
+# Local mail server used for the notification emails
+SMTP_HOST = 'localhost'
+SMTP_PORT = 25
+
+XML_HEADERS = {'Content-Type': 'application/xml', 'Accept': 'application/xml'}
+
+# Element tags and search paths used on Clarity responses. Only the root entities carry a
+# namespace; their child elements are unqualified.
+ARTIFACT_TAG = '{http://genologics.com/ri/artifact}artifact'
+SAMPLE_TAG = '{http://genologics.com/ri/sample}sample'
+FILE_TAG = '{http://genologics.com/ri/file}file'
+IO_MAP_TAG = 'input-output-map'
+NAME_TAG = 'name'
+SAMPLE_LINK_TAG = 'sample'
+PROJECT_LINK_TAG = 'project'
+RESEARCHER_LINK_PATH = 'researcher[@uri]'
+NEXT_PAGE_TAG = 'next-page'
+EMAIL_TAG = 'email'
+FILE_LINK_TAG = 'file'
+IS_PUBLISHED_TAG = 'is-published'
+EXCEPTION_MESSAGE_TAG = 'message'
+
+# Only exception responses declare this namespace, so a substring test spots them without parsing
+EXCEPTION_NAMESPACE = b'http://genologics.com/ri/exception'
+
+# lxml can filter iterparse events by tag in C; the stdlib parser reports every element
+IO_MAP_ITERPARSE_ARGS = {'tag': IO_MAP_TAG} if hasattr(ET, 'XPath') else {}
+SAMPLE_LIST_ITERPARSE_ARGS = {'tag': (SAMPLE_LINK_TAG, NEXT_PAGE_TAG)} if hasattr(ET, 'XPath') else {}
+
+# Names of the samples in a samples batch retrieve response. lxml returns them with one
+# compiled XPath (as plain strings); the stdlib parser walks the samples instead
+if hasattr(ET, 'XPath'):
+    find_sample_names = ET.XPath('smp:sample/name/text()',
+                                 namespaces={'smp': 'http://genologics.com/ri/sample'},
+                                 smart_strings=False)
+else:
+    def find_sample_names(details_root):
+        return [sample_elem.findtext(NAME_TAG) for sample_elem in details_root.iter(SAMPLE_TAG)]
+
+# Step URIs end in steps/{prefix}-{step LIMS ID number}, e.g. steps/24-12345
+STEP_LIMSID_RE = re.compile(r'steps/\d+-(\d+)')
+
+# XML payloads longer than this are truncated in the LabLink publish debug log
+MAX_DEBUG_LOG_PAYLOAD = 16 << 10
+
+# Value of the is-published element in a raw file record
+IS_PUBLISHED_VALUE_RE = re.compile(rb'<is-published>([^<]*)</is-published>')
+
+# Leading XML declaration of a raw record, which may not appear inside a batch payload
+XML_DECLARATION_RE = re.compile(rb'^\s*<\?xml[^>]*\?>\s*')
+
+# glsstorage request body, kept as bytes so it is filled in without re-encoding
+GLSSTORAGE_PAYLOAD_TEMPLATE = b'''<file:file xmlns:file="http://genologics.com/ri/file">
+    <attached-to>%b</attached-to>
+    <original-location>%b</original-location>
+</file:file>'''
+
+
+class PooledClarityAPI(glsapiutil3.glsapiutil3):
+    """
+    glsapiutil3 client that sends GET/PUT/POST requests through a shared
+    requests.Session, so every call reuses pooled keep-alive connections
+    instead of opening a new TCP/TLS connection.
+    """
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self._api_uri = None
+        # Parsed project XML by project URI, filled in by get_project_root
+        self.project_roots = {}
+
+    def getApiURI(self):
+        """
+        Return the base API URI (e.g. https://host/api/v2) without a trailing
+        slash. It is built on first use, which must be after setup().
+        """
+        if self._api_uri is None:
+            self._api_uri = self.getBaseURI().rstrip('/')
+        return self._api_uri
+
+    def GET(self, url):
+        return self.session.get(url, headers=XML_HEADERS).content
+
+    def PUT(self, xmlObject, url):
+        return self.session.put(url, data=xmlObject, headers=XML_HEADERS).content
+
+    def POST(self, xmlObject, url):
+        return self.session.post(url, data=xmlObject, headers=XML_HEADERS).content
+
+
+def create_session(username, password):
+    """Create an authenticated requests session with connection pooling and retries."""
+    session = requests.Session()
+    session.auth = HTTPBasicAuth(username, password)
+
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=Retry(total=3, backoff_factor=0.3)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
 
 def setupArguments():
     aParser = argparse.ArgumentParser("Groups sequence files by project, creates project-specific zip files, and uploads them to Clarity LIMS projects with LabLink publishing.")
@@ -31,217 +183,491 @@ def setupArguments():
     # log file
     aParser.add_argument('-l', action='store', dest='logfileName')
 
+    # verbose (debug) output
+    aParser.add_argument('-v', action='store_true', dest='verbose')
+
     return aParser.parse_args()
 
 
+def setupLogging(logfileName=None, verbose=False):
+    """
+    Send log output to stdout, and to the log file when one is given.
+    Records are handed to a background thread through a queue, so logging calls
+    in the processing and upload loops never wait on console or file I/O.
+    """
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if logfileName:
+        handlers.append(logging.FileHandler(logfileName))
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    # Flush anything still queued when the script exits
+    atexit.register(listener.stop)
+
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format='%(message)s',
+        handlers=[QueueHandler(log_queue)]
+    )
+
+
+class BufferedLogger(logging.LoggerAdapter):
+    """
+    Logger for work run on a worker thread. Records are kept instead of emitted,
+    so the caller can flush() them once the work is done and each worker's lines
+    come out together, in submission order, instead of interleaved.
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger, {})
+        self.records = []
+
+    def log(self, level, msg, *args, exc_info=None, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        # The traceback is captured now; it is gone by the time the record is flushed
+        if isinstance(exc_info, BaseException):
+            exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
+        elif exc_info and not isinstance(exc_info, tuple):
+            exc_info = sys.exc_info()
+        self.records.append(self.logger.makeRecord(
+            self.logger.name, level, '(unknown file)', 0, msg, args, exc_info or None
+        ))
+
+    def flush(self):
+        for record in self.records:
+            self.logger.handle(record)
+        self.records.clear()
+
+
 def locatedZip(api, attachmentName, stepURI, baseURI):
     """Find the zip file attached to the step."""
-    steplimsid = stepURI.split("steps/")[1].split("-")[1]
-    print(f"Step LIMS ID: {steplimsid}")
+    step_match = STEP_LIMSID_RE.search(stepURI)
+    if step_match is None:
+        logger.error(f"ERROR: Could not get step LIMS ID from: {stepURI}")
+        return None
+
+    steplimsid = step_match.group(1)
+    logger.info(f"Step LIMS ID: {steplimsid}")
 
     # URL encode the attachment name to handle spaces
     encoded_name = quote(attachmentName)
     filteredFilesURI = f'{baseURI}/api/v2/files?outputname={encoded_name}&steplimsid={steplimsid}'
-    print(f"Query URI: {filteredFilesURI}")
+    logger.info(f"Query URI: {filteredFilesURI}")
 
     response = api.GET(filteredFilesURI)
     root = ET.fromstring(response)
 
-    # Define the namespace
-    namespace = {'file': 'http://genologics.com/ri/file'}
-
     # Find the file element and get the uri attribute
-    file_element = root.find('file', namespace)
+    file_element = root.find(FILE_LINK_TAG)
 
     if file_element is not None:
         fileURI = file_element.get('uri')
-        print(f"Found file URI: {fileURI}")
+        logger.info(f"Found file URI: {fileURI}")
         return fileURI
     else:
-        print("No file found")
+        logger.info("No file found")
         return None
 
 
-def downloadZip(api, fileURI):
-    """Download the zip file from Clarity."""
+def downloadZip(session, fileURI):
+    """
+    Download the zip file from Clarity.
+    The response is streamed into a temporary file rather than held in memory,
+    and ZipFile reads members from it on demand.
+    """
     downloadURL = f'{fileURI}/download'
-    download = api.GET(downloadURL)
 
-    zip_data = io.BytesIO(download)
-    zip_file = zipfile.ZipFile(zip_data)
+    with session.get(downloadURL, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        # A real file, not a SpooledTemporaryFile: before Python 3.11 the latter has no
+        # seekable(), which ZipFile.open needs to read members
+        zip_tmp = tempfile.TemporaryFile(buffering=ZIP_IO_BUFFER_SIZE, suffix='.zip')
+        shutil.copyfileobj(response.raw, zip_tmp, ZIP_IO_BUFFER_SIZE)
+
+    zip_tmp.seek(0)
+    zip_file = zipfile.ZipFile(zip_tmp)
 
     return zip_file
 
 
 def interact_with_ab1_files(zip_file):
     """
-    Extract all sequence files from the zip archive to memory.
+    Index all sequence files in the zip archive.
     Groups files by their base name (without extension) to keep related files together.
-    Filters out directories and __MACOSX system files.
+    Filters out directories, hidden files and __MACOSX system files.
+    File contents are not read here; only files that match an artifact are read
+    later, when the project zip files are built.
     """
-    # Get all file names, excluding directories and __MACOSX files
-    file_names = [
-        f for f in zip_file.namelist()
-        if not f.endswith('/') and '__MACOSX' not in f
-    ]
-
-    print(f"\nFound {len(file_names)} actual files (excluding directories and system files)")
-
-    # Extract all files to memory, grouped by base name (without extension)
-    files_by_basename = {}
-    all_files_data = {}
-
-    for filename in file_names:
-        file_bytes = zip_file.read(filename)
-        all_files_data[filename] = file_bytes
+    # Index all files, grouped by base name (without extension), in a single
+    # pass over the zip entries, excluding directories and __MACOSX files
+    files_by_basename = defaultdict(list)
+    extensions_count = defaultdict(int)
+    file_count = 0
+
+    for zip_entry in zip_file.infolist():
+        filename = zip_entry.filename
+        if zip_entry.is_dir():
+            continue
 
-        # Get base name without extension
-        base_filename = os.path.basename(filename)
-        basename_no_ext = os.path.splitext(base_filename)[0]
-        extension = os.path.splitext(base_filename)[1]
+        # Skip anything inside a __MACOSX folder (macOS resource fork copies), at any
+        # depth; hidden files such as .DS_Store are skipped by their base name
+        folder, _, base_filename = filename.rpartition('/')
+        if folder and '__MACOSX' in folder.split('/'):
+            continue
+        if base_filename.startswith('.'):
+            continue
 
-        if basename_no_ext not in files_by_basename:
-            files_by_basename[basename_no_ext] = []
+        dot_index = base_filename.rfind('.')
+        if dot_index > 0:
+            basename_no_ext, extension = base_filename[:dot_index], base_filename[dot_index:]
+        else:
+            basename_no_ext, extension = base_filename, ''
 
         files_by_basename[basename_no_ext].append({
             'filename': filename,
             'base_filename': base_filename,
             'extension': extension,
-            'file_data': file_bytes
+            'zip_entry': zip_entry
         })
 
-    # Count file types
-    extensions_count = {}
-    for filename in file_names:
-        ext = os.path.splitext(filename)[1]
-        extensions_count[ext] = extensions_count.get(ext, 0) + 1
+        # Count file types
+        extensions_count[extension] += 1
+        file_count += 1
 
-    print(f"File types found:")
+    logger.info(f"\nFound {file_count} actual files (excluding directories and system files)")
+
+    logger.info(f"File types found:")
     for ext, count in sorted(extensions_count.items()):
         ext_display = ext if ext else "(no extension)"
-        print(f"  {ext_display}: {count} files")
+        logger.info(f"  {ext_display}: {count} files")
+
+    logger.info(f"Grouped into {len(files_by_basename)} unique base names")
 
-    print(f"Grouped into {len(files_by_basename)} unique base names")
+    return files_by_basename
 
-    return files_by_basename, all_files_data
+
+def release_parsed_element(elem):
+    """Free an element that has been read during iterparse."""
+    elem.clear()
+    # lxml keeps cleared elements attached to their parent; drop the ones already read
+    if hasattr(elem, 'getprevious'):
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
 
 
 def get_step_artifacts(api, stepURI):
     """Get all input-output mappings from the step."""
-    print(f"DEBUG: Getting step artifacts from: {stepURI}/details")
+    logger.debug(f"DEBUG: Getting step artifacts from: {stepURI}/details")
 
     step_response = api.GET(f'{stepURI}/details')
-    details_root = ET.fromstring(step_response)
-    print(f"DEBUG: Successfully retrieved step details XML")
+    logger.debug(f"DEBUG: Successfully retrieved step details XML")
 
     artifacts = []
+    io_map_count = 0
 
-    io_maps = details_root.findall('.//input-output-map')
-    print(f"DEBUG: Found {len(io_maps)} input-output mappings")
+    # Stream the details XML so only one input-output-map is held in memory at a time
+    for _, io_artifacts in ET.iterparse(io.BytesIO(step_response), **IO_MAP_ITERPARSE_ARGS):
+        if io_artifacts.tag != IO_MAP_TAG:
+            continue
 
-    for io_artifacts in io_maps:
+        io_map_count += 1
         resultFile = io_artifacts.find('output')
         input_elem = io_artifacts.find('input')
 
         if input_elem is not None and resultFile is not None:
-            input_uri = input_elem.get('uri')
-            artifact_name = get_artifact_name(api, input_uri)
-
             mapping = {
                 'input_limsid': input_elem.get('limsid'),
-                'input_uri': input_uri,
+                'input_uri': input_elem.get('uri'),
                 'output_limsid': resultFile.get('limsid'),
                 'output_uri': resultFile.get('uri'),
                 'output_generation_type': resultFile.get('output-generation-type'),
-                'artifact_name': artifact_name
+                'artifact_name': None,
+                'sample_uri': None
             }
             artifacts.append(mapping)
-            print(f"DEBUG: Mapped artifact: {artifact_name} ({mapping['input_limsid']}) -> {mapping['output_limsid']}")
 
-    print(f"DEBUG: Total artifacts collected: {len(artifacts)}")
+        release_parsed_element(io_artifacts)
+
+    logger.debug(f"DEBUG: Found {io_map_count} input-output mappings")
+
+    # Look up all input artifact names and samples in one batch call instead of one GET per input
+    input_uris = list(dict.fromkeys(mapping['input_uri'] for mapping in artifacts))
+    details_by_limsid = get_artifact_details(api, input_uris)
+
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    for mapping in artifacts:
+        artifact_name, sample_uri = details_by_limsid.get(mapping['input_limsid'], (None, None))
+        mapping['artifact_name'] = artifact_name
+        mapping['sample_uri'] = sample_uri
+        if debug_enabled:
+            logger.debug(f"DEBUG: Mapped artifact: {artifact_name} ({mapping['input_limsid']}) -> {mapping['output_limsid']}")
+
+    logger.debug(f"DEBUG: Total artifacts collected: {len(artifacts)}")
     return artifacts
 
 
-def get_artifact_name(api, artifactURI):
-    """Get the name of an artifact."""
-    artifact_elem = api.GET(artifactURI)
-    artifact_root = ET.fromstring(artifact_elem)
-    artifactName = artifact_root.find('.//name')
-    return artifactName.text if artifactName is not None else None
+def batch_retrieve(api, entity, uris):
+    """
+    Retrieve many Clarity entities of one kind (e.g. 'artifacts', 'samples') with
+    a single batch retrieve call. Returns the parsed details XML.
+    """
+    links = ''.join(f'<link uri="{escape(uri, XML_ATTR_ENTITIES)}" rel="{entity}"/>' for uri in uris)
+    links_payload = f'<ri:links xmlns:ri="http://genologics.com/ri">{links}</ri:links>'
+
+    base_uri = api.getApiURI()
+    batch_uri = f"{base_uri}/{entity}/batch/retrieve"
+    logger.debug(f"DEBUG: Retrieving {len(uris)} {entity} from: {batch_uri}")
+
+    batch_response = api.POST(links_payload.encode('utf-8'), batch_uri)
+    return ET.fromstring(batch_response)
+
+
+def get_artifact_details(api, artifactURIs):
+    """
+    Get the names and sample URIs of many artifacts with a single batch retrieve call.
+    Returns a dict mapping artifact LIMS ID to an (artifact name, sample URI) tuple.
+    """
+    if not artifactURIs:
+        return {}
+
+    details_root = batch_retrieve(api, 'artifacts', artifactURIs)
+
+    details_by_limsid = {}
+    for artifact_elem in details_root.iter(ARTIFACT_TAG):
+        sample_elem = artifact_elem.find(SAMPLE_LINK_TAG)
+        details_by_limsid[artifact_elem.get('limsid')] = (
+            artifact_elem.findtext(NAME_TAG),
+            sample_elem.get('uri') if sample_elem is not None else None
+        )
+
+    return details_by_limsid
+
+
+def get_sample_projects(api, sampleURIs):
+    """
+    Get the project of many samples with a single batch retrieve call.
+    Returns a dict mapping sample URI to a (project URI, project LIMS ID) tuple;
+    samples without a project are left out. Returns None if the batch retrieve
+    failed, so the caller can look the artifacts up one by one.
+    """
+    if not sampleURIs:
+        return {}
+
+    try:
+        details_root = batch_retrieve(api, 'samples', sampleURIs)
+    except Exception as e:
+        logger.exception(f"  ERROR: Samples batch retrieve failed: {e}")
+        return None
+
+    projects_by_sample = {}
+    for sample_elem in details_root.iter(SAMPLE_TAG):
+        project_elem = sample_elem.find(PROJECT_LINK_TAG)
+        if project_elem is not None:
+            projects_by_sample[sample_elem.get('uri')] = (project_elem.get('uri'), project_elem.get('limsid'))
+
+    return projects_by_sample
+
+
+def get_project_root(api, project_uri):
+    """
+    Get the parsed project XML. A run only touches a few projects but looks each one
+    up several times (name, researcher, samples), so responses are cached on the API
+    client for the run. The returned element is shared and must not be modified.
+    """
+    project_root = api.project_roots.get(project_uri)
+    if project_root is None:
+        project_root = ET.fromstring(api.GET(project_uri))
+        api.project_roots[project_uri] = project_root
+    return project_root
+
+
+def get_project_names(api, projectURIs):
+    """
+    Get the names of the given projects. Clarity has no batch retrieve for
+    projects, but a step's samples only span a few, so they are fetched concurrently.
+    Returns a dict mapping project URI to project name (None if it has no name or
+    could not be retrieved).
+    """
+    def get_project_name(project_uri):
+        try:
+            return get_project_root(api, project_uri).findtext(NAME_TAG)
+        except Exception as e:
+            logger.exception(f"  ERROR: Could not get name of project {project_uri}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS) as executor:
+        return dict(zip(projectURIs, executor.map(get_project_name, projectURIs)))
 
 
-def get_project_from_artifact(api, artifactURI):
-    """Get the project information from an artifact via its samples."""
-    print(f"  DEBUG: Getting project info for artifact: {artifactURI}")
+def get_project_from_artifact(api, artifactURI, project_names=None):
+    """
+    Get the project information from an artifact via its samples.
+    project_names, if given, is a dict of project URI to project name shared
+    between calls, so each project is only fetched once.
+    """
+    logger.debug(f"  DEBUG: Getting project info for artifact: {artifactURI}")
 
     try:
         # Get the artifact
         artifact_response = api.GET(artifactURI)
         artifact_root = ET.fromstring(artifact_response)
-        print(f"  DEBUG: Successfully retrieved artifact XML")
-
-        # Find the sample elements in the artifact
-        # Namespace for artifacts
-        namespaces = {
-            'art': 'http://genologics.com/ri/artifact',
-            'udf': 'http://genologics.com/ri/userdefined'
-        }
+        logger.debug(f"  DEBUG: Successfully retrieved artifact XML")
 
-        # Look for sample elements
-        sample_elem = artifact_root.find('.//sample', namespaces)
-        if sample_elem is None:
-            sample_elem = artifact_root.find('.//sample')
+        # Find the sample element in the artifact
+        sample_elem = artifact_root.find(SAMPLE_LINK_TAG)
 
         if sample_elem is None:
-            print(f"  WARNING: No sample found for artifact {artifactURI}")
+            logger.warning(f"  WARNING: No sample found for artifact {artifactURI}")
             return None
 
         sample_uri = sample_elem.get('uri')
         if not sample_uri:
-            print(f"  WARNING: No sample URI found")
+            logger.warning(f"  WARNING: No sample URI found")
             return None
 
-        print(f"  DEBUG: Found sample URI: {sample_uri}")
+        logger.debug(f"  DEBUG: Found sample URI: {sample_uri}")
 
         # Get the sample to find its project
         sample_response = api.GET(sample_uri)
         sample_root = ET.fromstring(sample_response)
-        print(f"  DEBUG: Successfully retrieved sample XML")
+        logger.debug(f"  DEBUG: Successfully retrieved sample XML")
 
         # Find the project element
-        project_elem = sample_root.find('.//project')
+        project_elem = sample_root.find(PROJECT_LINK_TAG)
         if project_elem is None:
-            print(f"  WARNING: No project found for sample {sample_uri}")
+            logger.warning(f"  WARNING: No project found for sample {sample_uri}")
             return None
 
         project_uri = project_elem.get('uri')
         project_limsid = project_elem.get('limsid')
-        print(f"  DEBUG: Found project - URI: {project_uri}, LIMS ID: {project_limsid}")
+        logger.debug(f"  DEBUG: Found project - URI: {project_uri}, LIMS ID: {project_limsid}")
 
-        # Get project details to get the name
-        project_response = api.GET(project_uri)
-        project_root = ET.fromstring(project_response)
-        print(f"  DEBUG: Successfully retrieved project XML")
+        project_name = project_names.get(project_uri) if project_names is not None else None
+        if project_name is None:
+            # Get project details to get the name
+            project_root = get_project_root(api, project_uri)
+            logger.debug(f"  DEBUG: Successfully retrieved project XML")
 
-        project_name_elem = project_root.find('.//name')
-        project_name = project_name_elem.text if project_name_elem is not None else project_limsid
-        print(f"  DEBUG: Project name: {project_name}")
+            project_name = project_root.findtext(NAME_TAG) or project_limsid
+            if project_names is not None:
+                project_names[project_uri] = project_name
+        logger.debug(f"  DEBUG: Project name: {project_name}")
 
         result = {
             'project_name': project_name,
             'project_limsid': project_limsid,
             'project_uri': project_uri
         }
-        print(f"  DEBUG: Returning project info dictionary")
+        logger.debug(f"  DEBUG: Returning project info dictionary")
         return result
 
     except Exception as e:
-        print(f"  ERROR: Exception in get_project_from_artifact: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"  ERROR: Exception in get_project_from_artifact: {e}")
         return None
 
 
+def find_matching_basenames(artifact_names, basenames):
+    """
+    Find the matching base name for each artifact name (case insensitive).
+    A base name equal to the artifact name is preferred. Every other base name
+    belongs to the longest artifact name it starts with (followed by '_' or the end
+    of the name), or else to the longest artifact name it contains. Each artifact
+    takes the first base name it owns, preferring one that starts with its name.
+    A base name is never matched to more than one artifact.
+    Returns a dict mapping artifact name to its matched base name; artifacts with
+    no matching base name are left out.
+
+    When pyahocorasick is installed, the artifact names contained in each base
+    name are found in a single pass; otherwise every pair is compared.
+    """
+    names_by_folded = {}
+    for artifact_name in artifact_names:
+        if artifact_name:
+            names_by_folded.setdefault(artifact_name.casefold(), []).append(artifact_name)
+
+    matched = {}
+    if not names_by_folded:
+        return matched
+
+    # Case-fold each base name once rather than once per artifact
+    folded_basenames = [(basename.casefold(), basename) for basename in basenames]
+
+    # Exact matches are found with a dict lookup; only the rest need a substring search
+    exact_basenames = {}
+    for folded_basename, basename in folded_basenames:
+        exact_basenames.setdefault(folded_basename, basename)
+
+    for folded_name in list(names_by_folded):
+        basename = exact_basenames.get(folded_name)
+        if basename is not None:
+            for artifact_name in names_by_folded.pop(folded_name):
+                matched[artifact_name] = basename
+
+    if not names_by_folded:
+        return matched
+
+    # A file group named exactly after one artifact belongs to that artifact only
+    claimed_basenames = set(matched.values())
+    folded_basenames = [(folded_basename, basename) for folded_basename, basename in folded_basenames
+                        if basename not in claimed_basenames]
+
+    # Each remaining base name belongs to at most one artifact. Sanger base names
+    # usually start with the artifact name followed by '_' (e.g. Sample1_A01), so an
+    # artifact name the base name starts with wins, then the longest one: "JD_2_B01"
+    # goes to "JD_2" rather than "JD", and "S12_A01" to "S12" rather than "S1".
+    # Equally ranked names go to the artifact that comes first.
+    name_order = {folded_name: position for position, folded_name in enumerate(names_by_folded)}
+
+    def is_leading(folded_name, folded_basename):
+        return (folded_basename.startswith(folded_name)
+                and folded_basename[len(folded_name):len(folded_name) + 1] in ('', '_'))
+
+    def owner_rank(folded_basename):
+        return lambda folded_name: (is_leading(folded_name, folded_basename),
+                                    len(folded_name), -name_order[folded_name])
+
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for folded_name in names_by_folded:
+            automaton.add_word(folded_name, folded_name)
+        automaton.make_automaton()
+
+        def find_owner(folded_basename):
+            return max((folded_name for _, folded_name in automaton.iter(folded_basename)),
+                       key=owner_rank(folded_basename), default=None)
+    else:
+        def find_owner(folded_basename):
+            # Check if artifact name appears in base name (case insensitive)
+            return max((folded_name for folded_name in names_by_folded
+                        if folded_name in folded_basename),
+                       key=owner_rank(folded_basename), default=None)
+
+    # Base names are assigned in order, so each artifact keeps the first one it owns,
+    # preferring one that starts with its name over one that only contains it
+    leading_matches = {}
+    substring_matches = {}
+    for folded_basename, basename in folded_basenames:
+        owner = find_owner(folded_basename)
+        if owner is None:
+            continue
+        if is_leading(owner, folded_basename):
+            leading_matches.setdefault(owner, basename)
+        else:
+            substring_matches.setdefault(owner, basename)
+
+    for folded_name, names in names_by_folded.items():
+        basename = leading_matches.get(folded_name, substring_matches.get(folded_name))
+        if basename is not None:
+            for artifact_name in names:
+                matched[artifact_name] = basename
+
+    return matched
+
+
 def match_artifacts_to_files(api, artifacts, files_by_basename):
     """
     Match artifact names to file groups by base name (ignoring extensions).
@@ -252,81 +678,114 @@ def match_artifacts_to_files(api, artifacts, files_by_basename):
     unique_artifacts = {}
     for artifact in artifacts:
         input_limsid = artifact['input_limsid']
-        if input_limsid not in unique_artifacts:
-            unique_artifacts[input_limsid] = {
-                'input_limsid': input_limsid,
-                'input_uri': artifact['input_uri'],
-                'artifact_name': artifact['artifact_name'],
-                'per_input_output': None,
-                'all_outputs': [],
-                'project': None
-            }
+        entry = unique_artifacts.setdefault(input_limsid, {
+            'input_limsid': input_limsid,
+            'input_uri': artifact['input_uri'],
+            'artifact_name': artifact['artifact_name'],
+            'sample_uri': artifact.get('sample_uri'),
+            'per_input_output': None,
+            'all_outputs': [],
+            'project': None
+        })
+        generation_type = artifact.get('output_generation_type')
 
         # Store the PerInput output specifically
-        if artifact.get('output_generation_type') == 'PerInput':
-            unique_artifacts[input_limsid]['per_input_output'] = {
+        if generation_type == 'PerInput':
+            entry['per_input_output'] = {
                 'output_limsid': artifact['output_limsid'],
                 'output_uri': artifact['output_uri']
             }
 
         # Store all outputs
-        unique_artifacts[input_limsid]['all_outputs'].append({
+        entry['all_outputs'].append({
             'output_limsid': artifact['output_limsid'],
             'output_uri': artifact['output_uri'],
-            'generation_type': artifact.get('output_generation_type')
+            'generation_type': generation_type
         })
 
     # Get project information for each artifact
-    print("\nGetting project information for artifacts...")
-    print(f"DEBUG: Processing {len(unique_artifacts)} unique artifacts")
+    logger.info("\nGetting project information for artifacts...")
+    logger.debug(f"DEBUG: Processing {len(unique_artifacts)} unique artifacts")
+
+    # Resolve sample -> project for all inputs with one samples batch retrieve,
+    # then fetch each distinct project's name once
+    sample_uris = list(dict.fromkeys(
+        data['sample_uri'] for data in unique_artifacts.values() if data['sample_uri']
+    ))
+    projects_by_sample = get_sample_projects(api, sample_uris)
+    if projects_by_sample is None:
+        # The samples batch failed; look each artifact up on its own instead
+        for data in unique_artifacts.values():
+            data['sample_uri'] = None
+        projects_by_sample = {}
+    project_names = get_project_names(
+        api, list(dict.fromkeys(project_uri for project_uri, _ in projects_by_sample.values()))
+    )
 
-    for input_limsid, data in unique_artifacts.items():
-        artifact_name = data['artifact_name']
-        artifact_uri = data['input_uri']
-        print(f"\nDEBUG: Processing artifact: {artifact_name} (LIMS ID: {input_limsid})")
-        print(f"DEBUG: Artifact URI: {artifact_uri}")
+    project_infos = {}
+    for data in unique_artifacts.values():
+        sample_uri = data['sample_uri']
+        if sample_uri is None:
+            # The batch retrieves did not resolve this artifact; look it up directly
+            project_infos[data['input_uri']] = get_project_from_artifact(api, data['input_uri'], project_names)
+        elif sample_uri not in project_infos:
+            project_link = projects_by_sample.get(sample_uri)
+            if project_link is None:
+                logger.warning(f"  WARNING: No project found for sample {sample_uri}")
+                project_infos[sample_uri] = None
+            else:
+                project_uri, project_limsid = project_link
+                project_infos[sample_uri] = {
+                    'project_name': project_names.get(project_uri) or project_limsid,
+                    'project_limsid': project_limsid,
+                    'project_uri': project_uri
+                }
 
-        project_info = get_project_from_artifact(api, artifact_uri)
+    # Per-artifact debug messages are only formatted when debug output is enabled
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
-        print(f"DEBUG: project_info type: {type(project_info)}")
-        print(f"DEBUG: project_info value: {project_info}")
+    # Report results in artifact order
+    for input_limsid, data in unique_artifacts.items():
+        project_info = project_infos[data['sample_uri'] or data['input_uri']]
+        artifact_name = data['artifact_name']
+        if debug_enabled:
+            logger.debug(f"\nDEBUG: Processing artifact: {artifact_name} (LIMS ID: {input_limsid})")
+            logger.debug(f"DEBUG: Artifact URI: {data['input_uri']}")
+            logger.debug(f"DEBUG: project_info value: {project_info}")
 
         if project_info is not None:
             data['project'] = project_info
-            artifact_name_padded = artifact_name.ljust(20)
-            project_name = project_info['project_name']
-            print(f"  SUCCESS: {artifact_name_padded} -> Project: {project_name}")
+            logger.info(f"  SUCCESS: {artifact_name:<20} -> Project: {project_info['project_name']}")
         else:
-            print(f"  WARNING: Could not get project info for {artifact_name}")
+            logger.warning(f"  WARNING: Could not get project info for {artifact_name}")
             data['project'] = None
 
-    print(f"\nDeduplicating: {len(artifacts)} total mappings -> {len(unique_artifacts)} unique inputs")
-    print("\nArtifacts to match:")
-    for input_limsid, data in unique_artifacts.items():
-        artifact_name = data['artifact_name']
-        print(f"  {artifact_name}")
+    logger.info(f"\nDeduplicating: {len(artifacts)} total mappings -> {len(unique_artifacts)} unique inputs")
+    # The full listings are only built when debug output is enabled
+    logger.info("\nArtifacts to match:")
+    if debug_enabled:
+        for input_limsid, data in unique_artifacts.items():
+            artifact_name = data['artifact_name']
+            logger.debug(f"  {artifact_name}")
 
-    print("\nFile groups to match (by base name):")
-    for basename, file_list in files_by_basename.items():
-        extensions = ', '.join([f['extension'] for f in file_list])
-        print(f"  {basename} ({extensions})")
+    logger.info("\nFile groups to match (by base name):")
+    if debug_enabled:
+        for basename, file_list in files_by_basename.items():
+            extensions = ', '.join([f['extension'] for f in file_list])
+            logger.debug(f"  {basename} ({extensions})")
 
     matches = []
     unmatched_basenames = set(files_by_basename.keys())
 
-    print("\n=== MATCHING (by base name, ignoring extensions) ===")
+    # Find the matching file group for every artifact name in one pass
+    artifact_names = [data['artifact_name'] for data in unique_artifacts.values()]
+    basename_by_artifact = find_matching_basenames(artifact_names, files_by_basename)
+
+    logger.info("\n=== MATCHING (by base name, ignoring extensions) ===")
     for input_limsid, data in unique_artifacts.items():
         artifact_name = data['artifact_name']
-        matched_basename = None
-        matched_files = []
-
-        # Try to find matching file group by base name
-        for basename, file_list in files_by_basename.items():
-            # Check if artifact name appears in base name (case insensitive)
-            if artifact_name.upper() in basename.upper():
-                matched_basename = basename
-                matched_files = file_list
-                break
+        matched_basename = basename_by_artifact.get(artifact_name)
+        matched_files = files_by_basename[matched_basename] if matched_basename else []
 
         result = {
             'input_limsid': input_limsid,
@@ -342,22 +801,18 @@ def match_artifacts_to_files(api, artifacts, files_by_basename):
         matches.append(result)
 
         if matched_files:
-            if matched_basename in unmatched_basenames:
-                unmatched_basenames.discard(matched_basename)
-            artifact_name_padded = artifact_name.ljust(20)
+            unmatched_basenames.discard(matched_basename)
             file_extensions = ', '.join([f['extension'] for f in matched_files])
-            file_count = len(matched_files)
-            print(f"✓ {artifact_name_padded} -> {matched_basename} ({file_count} files: {file_extensions})")
+            logger.info(f"✓ {artifact_name:<20} -> {matched_basename} ({len(matched_files)} files: {file_extensions})")
         else:
-            artifact_name_padded = artifact_name.ljust(20)
-            print(f"✗ {artifact_name_padded} -> NO MATCH")
+            logger.warning(f"✗ {artifact_name:<20} -> NO MATCH")
 
     if unmatched_basenames:
-        print(f"\n⚠ Unmatched file groups:")
+        logger.warning(f"\n⚠ Unmatched file groups:")
         for basename in sorted(unmatched_basenames):
             file_list = files_by_basename[basename]
             extensions = ', '.join([f['extension'] for f in file_list])
-            print(f"  - {basename} ({extensions})")
+            logger.warning(f"  - {basename} ({extensions})")
 
     return matches
 
@@ -368,25 +823,27 @@ def group_matches_by_project(matches):
     Now handles multiple files per match (e.g., .ab1, .txt, .seq for same sample).
     Returns a dict mapping project_limsid to project info and file list.
     """
-    print(f"DEBUG: Grouping {len(matches)} matches by project")
+    logger.debug(f"DEBUG: Grouping {len(matches)} matches by project")
     projects = {}
+    # Per-match and per-file debug messages are only formatted when debug output is enabled
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
     for match in matches:
         artifact_name = match['artifact_name']
-        has_files = bool(match['matched_files'])
-        has_project = bool(match['project'])
 
-        print(f"DEBUG: Match for {artifact_name}: files={has_files}, project={has_project}")
+        if debug_enabled:
+            logger.debug(f"DEBUG: Match for {artifact_name}: files={bool(match['matched_files'])}, project={bool(match['project'])}")
 
         # Only process matches that have files and project info
         if not match['matched_files'] or not match['project']:
-            print(f"DEBUG: Skipping {artifact_name} - missing required data")
+            if debug_enabled:
+                logger.debug(f"DEBUG: Skipping {artifact_name} - missing required data")
             continue
 
         project_limsid = match['project']['project_limsid']
         project_name = match['project']['project_name']
-        file_count = len(match['matched_files'])
-        print(f"DEBUG: Adding {artifact_name} ({file_count} files) to project {project_name} ({project_limsid})")
+        if debug_enabled:
+            logger.debug(f"DEBUG: Adding {artifact_name} ({len(match['matched_files'])} files) to project {project_name} ({project_limsid})")
 
         if project_limsid not in projects:
             projects[project_limsid] = {
@@ -395,58 +852,73 @@ def group_matches_by_project(matches):
                 'project_uri': match['project']['project_uri'],
                 'files': []
             }
-            print(f"DEBUG: Created new project group for {project_name}")
+            logger.debug(f"DEBUG: Created new project group for {project_name}")
 
         # Add all matched files to this project's list
         for file_info in match['matched_files']:
             projects[project_limsid]['files'].append({
                 'filename': file_info['base_filename'],
-                'file_data': file_info['file_data'],
+                'extension': file_info['extension'],
+                'zip_entry': file_info['zip_entry'],
                 'artifact_name': artifact_name,
                 'input_limsid': match['input_limsid']
             })
-            print(f"DEBUG: Added file {file_info['base_filename']} to project {project_name}")
+            if debug_enabled:
+                logger.debug(f"DEBUG: Added file {file_info['base_filename']} to project {project_name}")
 
-    print(f"DEBUG: Total projects with files: {len(projects)}")
-    for proj_id, proj_data in projects.items():
-        proj_name = proj_data['project_name']
-        file_count = len(proj_data['files'])
-        print(f"DEBUG: Project {proj_name} ({proj_id}): {file_count} files")
+    logger.debug(f"DEBUG: Total projects with files: {len(projects)}")
+    if debug_enabled:
+        for proj_id, proj_data in projects.items():
+            logger.debug(f"DEBUG: Project {proj_data['project_name']} ({proj_id}): {len(proj_data['files'])} files")
 
     return projects
 
 
-def create_project_zip_files(projects):
+def create_project_zip_files(zip_file, projects):
     """
-    Create a zip file in memory for each project containing its ab1 files.
-    Returns a dict mapping project_limsid to zip file data.
+    Create a zip file for each project containing its ab1 files. Each zip is kept
+    in memory, spilling to a temporary file if it grows past ZIP_SPOOL_MAX_SIZE.
+    Matched files are streamed from the downloaded run folder zip as they are added.
+    Returns a dict mapping project_limsid to zip info with the open zip file buffer,
+    which is closed once the zip has been uploaded.
     """
     project_zips = {}
 
-    print("\n" + "="*50)
-    print("CREATING PROJECT ZIP FILES")
-    print("="*50)
+    logger.info("\n" + "="*50)
+    logger.info("CREATING PROJECT ZIP FILES")
+    logger.info("="*50)
 
     for project_limsid, project_data in projects.items():
         project_name = project_data['project_name']
         files = project_data['files']
 
-        print(f"\nProject: {project_name} ({project_limsid})")
-        print(f"  Files to include: {len(files)}")
+        logger.info(f"\nProject: {project_name} ({project_limsid})")
+        logger.info(f"  Files to include: {len(files)}")
 
-        # Create zip file in memory
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        # Create zip file in memory (or a temp file once it gets large)
+        zip_buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE, suffix='.zip')
+        # .ab1 traces are binary and barely compress, so files are stored as-is
+        # unless they are text sidecars (see DEFLATED_EXTENSIONS)
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as project_zip:
             for file_info in files:
                 filename = file_info['filename']
-                file_data = file_info['file_data']
-
-                print(f"    Adding: {filename}")
-                zip_file.writestr(filename, file_data)
-
-        # Get the zip data
+                zip_entry = file_info['zip_entry']
+
+                # Declaring the size up front lets zipfile pick zip64 headers for
+                # large members; the original timestamp is kept as well
+                member_info = zipfile.ZipInfo(filename, date_time=zip_entry.date_time)
+                member_info.file_size = zip_entry.file_size
+                if file_info['extension'].lower() in DEFLATED_EXTENSIONS:
+                    member_info.compress_type = zipfile.ZIP_DEFLATED
+
+                logger.debug(f"    Adding: {filename}")
+                with zip_file.open(zip_entry) as src, \
+                        project_zip.open(member_info, 'w') as dst:
+                    shutil.copyfileobj(src, dst, ZIP_IO_BUFFER_SIZE)
+
+        # Rewind the buffer so it can be uploaded without copying it
+        zip_size = zip_buffer.tell()
         zip_buffer.seek(0)
-        zip_data = zip_buffer.read()
 
         zip_filename = f"{project_name}_sequencing_files.zip"
 
@@ -455,528 +927,600 @@ def create_project_zip_files(projects):
             'project_limsid': project_limsid,
             'project_uri': project_data['project_uri'],
             'zip_filename': zip_filename,
-            'zip_data': zip_data,
+            'zip_buffer': zip_buffer,
             'file_count': len(files)
         }
 
-        print(f"  ✓ Created {zip_filename} ({len(zip_data)} bytes)")
+        logger.info(f"  ✓ Created {zip_filename} ({zip_size} bytes)")
 
     return project_zips
 
 
-def upload_file_to_artifact(api, artifact_uri, file_data, filename, username, password):
+class MultipartUploadBody:
     """
-    Upload a file and attach it to an artifact in Clarity LIMS.
+    multipart/form-data request body for a single file, read from the file object
+    while it is sent instead of being built in memory. requests passes any object
+    with read() to the connection as a stream, and takes the Content-Length from len().
+    """
+
+    def __init__(self, field_name, file_obj, filename, content_type):
+        boundary = choose_boundary()
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+
+        # Same framing requests uses for files=, via urllib3's multipart helpers
+        field = RequestField(name=field_name, data=b'', filename=filename)
+        field.make_multipart(content_type=content_type)
+        header = f'--{boundary}\r\n'.encode('latin-1') + field.render_headers().encode('utf-8')
+        footer = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+
+        file_size = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(0)
+        self._length = len(header) + file_size + len(footer)
+        self._parts = [io.BytesIO(header), file_obj, io.BytesIO(footer)]
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and size != 0:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+
+def upload_file(api, attached_to_uri, file_obj, filename, content_type, log=logger):
+    """
+    Upload a file and attach it to an artifact or project in Clarity LIMS.
     Based on Illumina's cookbook example.
+    file_obj is a binary file object positioned at the start of the content.
+    Returns the file LIMS ID, URI and file record XML, or Nones if it failed.
+    Progress is logged to log (the module logger by default).
     """
     # Step 1: Create storage location using glsstorage endpoint
-    glsstorage_payload = f'''<file:file xmlns:file="http://genologics.com/ri/file">
-    <attached-to>{artifact_uri}</attached-to>
-    <original-location>{filename}</original-location>
-</file:file>'''
-
-    glsstorage_payload_bytes = glsstorage_payload.encode('utf-8')
+    glsstorage_payload_bytes = GLSSTORAGE_PAYLOAD_TEMPLATE % (
+        escape(attached_to_uri).encode('utf-8'),
+        escape(filename).encode('utf-8')
+    )
 
-    base_uri = api.getBaseURI().rstrip('/')
+    base_uri = api.getApiURI()
     glsstorage_uri = f"{base_uri}/glsstorage"
 
-    print(f"  Creating storage location at: {glsstorage_uri}")
+    log.info(f"  Creating storage location at: {glsstorage_uri}")
     storage_response = api.POST(glsstorage_payload_bytes, glsstorage_uri)
 
-    # Parse to get content-location
-    storage_root = ET.fromstring(storage_response)
-
-    # Check for errors
-    if 'exception' in storage_root.tag:
-        message_elem = storage_root.find('.//{http://genologics.com/ri/exception}message')
-        if message_elem is None:
-            message_elem = storage_root.find('.//message')
-        error_msg = message_elem.text if message_elem is not None else "Unknown error"
-        print(f"  ERROR creating storage: {error_msg}")
-        return None, None
-
-    # Get content-location from response
-    content_location_elem = storage_root.find('.//{http://genologics.com/ri/file}content-location')
-    if content_location_elem is None:
-        content_location_elem = storage_root.find('.//content-location')
-
-    if content_location_elem is None or content_location_elem.text is None:
-        print(f"  ERROR: No content-location in storage response")
-        response_text = storage_response.decode('utf-8')
-        print(f"  Response: {response_text}")
-        return None, None
-
-    content_location = content_location_elem.text
-    print(f"  Got content location: {content_location}")
+    # The storage response is posted to /files as-is, so it is only parsed when
+    # it is an exception
+    if EXCEPTION_NAMESPACE in storage_response:
+        storage_root = ET.fromstring(storage_response)
+        error_msg = storage_root.findtext(EXCEPTION_MESSAGE_TAG) or "Unknown error"
+        log.error(f"  ERROR creating storage: {error_msg}")
+        return None, None, None
 
     # Step 2: Create the file record using /files endpoint
     files_uri = f"{base_uri}/files"
-    print(f"  Creating file record at: {files_uri}")
-    file_response = api.POST(storage_response, files_uri)  # Use the storage_response XML
+    log.info(f"  Creating file record at: {files_uri}")
+    file_response = api.POST(storage_response, files_uri)
 
     # Parse file response
     file_root = ET.fromstring(file_response)
 
     if 'exception' in file_root.tag:
-        message_elem = file_root.find('.//{http://genologics.com/ri/exception}message')
-        if message_elem is None:
-            message_elem = file_root.find('.//message')
-        error_msg = message_elem.text if message_elem is not None else "Unknown error"
-        print(f"  ERROR creating file record: {error_msg}")
-        return None, None
+        error_msg = file_root.findtext(EXCEPTION_MESSAGE_TAG) or "Unknown error"
+        log.error(f"  ERROR creating file record: {error_msg}")
+        return None, None, None
 
     file_uri = file_root.get('uri')
     file_limsid = file_root.get('limsid')
 
     if not file_uri:
-        print("  ERROR: Failed to get file URI from response")
-        return None, None
+        log.error("  ERROR: Failed to get file URI from response")
+        return None, None, None
 
-    print(f"  Created file record: {file_limsid}")
+    log.info(f"  Created file record: {file_limsid}")
 
     # Step 3: Upload the actual file content using requests (multipart/form-data)
-    import requests
-    from requests.auth import HTTPBasicAuth
-
     upload_url = f'{file_uri}/upload'
-    print(f"  Uploading file content to: {upload_url}")
+    log.info(f"  Uploading file content to: {upload_url}")
 
-    # Create multipart form data
-    files_payload = {'file': (filename, io.BytesIO(file_data), 'application/octet-stream')}
+    # Create multipart form data; requests would read the whole file into memory
+    # for files=, so the body is streamed from file_obj instead
+    upload_body = MultipartUploadBody('file', file_obj, filename, content_type)
 
-    # Use the passed username and password
-    upload_response = requests.post(
+    # Send through the API's pooled, authenticated session
+    upload_response = api.session.post(
         upload_url,
-        files=files_payload,
-        auth=HTTPBasicAuth(username, password)
+        data=upload_body,
+        headers={'Content-Type': upload_body.content_type}
     )
 
     if upload_response.status_code == 200 or upload_response.status_code == 201:
-        print(f"  ✓ File uploaded successfully")
+        log.info(f"  ✓ File uploaded successfully")
     else:
         status_code = upload_response.status_code
         response_text = upload_response.text
-        print(f"  ⚠ Upload status: {status_code}")
-        print(f"  Response: {response_text}")
+        log.warning(f"  ⚠ Upload status: {status_code}")
+        log.info(f"  Response: {response_text}")
 
-    return file_limsid, file_uri
+    return file_limsid, file_uri, file_response
 
 
-def upload_file_to_project(api, project_uri, file_data, filename, username, password):
+def upload_project_zip(api, project_limsid, zip_info, log=logger):
     """
-    Upload a file and attach it to a project in Clarity LIMS.
+    Upload one project zip file to its project in Clarity LIMS.
+    Returns the uploaded zip info, or None if the upload failed.
+    Progress is logged to log (the module logger by default).
     """
-    # Step 1: Create storage location using glsstorage endpoint
-    glsstorage_payload = f'''<file:file xmlns:file="http://genologics.com/ri/file">
-    <attached-to>{project_uri}</attached-to>
-    <original-location>{filename}</original-location>
-</file:file>'''
+    project_name = zip_info['project_name']
+    project_uri = zip_info['project_uri']
+    zip_filename = zip_info['zip_filename']
+    zip_buffer = zip_info['zip_buffer']
+    file_count = zip_info['file_count']
 
-    glsstorage_payload_bytes = glsstorage_payload.encode('utf-8')
-
-    base_uri = api.getBaseURI().rstrip('/')
-    glsstorage_uri = f"{base_uri}/glsstorage"
+    log.info(f"\nProject: {project_name} ({project_limsid})")
+    log.info(f"  Uploading: {zip_filename} ({file_count} files)")
 
-    print(f"  Creating storage location at: {glsstorage_uri}")
-    storage_response = api.POST(glsstorage_payload_bytes, glsstorage_uri)
+    try:
+        file_limsid, file_uri, file_xml = upload_file(
+            api,
+            project_uri,
+            zip_buffer,
+            zip_filename,
+            'application/zip',
+            log
+        )
+
+        if file_limsid and file_uri:
+            log.info(f"  ✓ Upload successful for {project_name}!")
+            return {
+                'project_name': project_name,
+                'project_limsid': project_limsid,
+                'project_uri': project_uri,
+                'zip_filename': zip_filename,
+                'file_limsid': file_limsid,
+                'file_uri': file_uri,
+                'file_xml': file_xml,
+                'file_count': file_count
+            }
 
-    # Parse to get content-location
-    storage_root = ET.fromstring(storage_response)
+        log.error(f"  ✗ Failed for {project_name}: Could not create file record")
 
-    # Check for errors
-    if 'exception' in storage_root.tag:
-        message_elem = storage_root.find('.//{http://genologics.com/ri/exception}message')
-        if message_elem is None:
-            message_elem = storage_root.find('.//message')
-        error_msg = message_elem.text if message_elem is not None else "Unknown error"
-        print(f"  ERROR creating storage: {error_msg}")
-        return None, None
+    except Exception as e:
+        log.exception(f"  ✗ Failed for {project_name}: {e}")
 
-    # Get content-location from response
-    content_location_elem = storage_root.find('.//{http://genologics.com/ri/file}content-location')
-    if content_location_elem is None:
-        content_location_elem = storage_root.find('.//content-location')
+    finally:
+        # The zip is only needed for the upload; release its memory or temp file
+        zip_buffer.close()
 
-    if content_location_elem is None or content_location_elem.text is None:
-        print(f"  ERROR: No content-location in storage response")
-        response_text = storage_response.decode('utf-8')
-        print(f"  Response: {response_text}")
-        return None, None
+    return None
 
-    content_location = content_location_elem.text
-    print(f"  Got content location: {content_location}")
 
-    # Step 2: Create the file record using /files endpoint
-    files_uri = f"{base_uri}/files"
-    print(f"  Creating file record at: {files_uri}")
-    file_response = api.POST(storage_response, files_uri)
+def upload_project_zips(api, project_zips):
+    """
+    Upload project zip files to their respective projects in Clarity LIMS.
+    Each project's upload is independent, so they run concurrently.
+    """
+    logger.info("\n" + "="*50)
+    logger.info("UPLOADING ZIP FILES TO PROJECTS")
+    logger.info("="*50)
 
-    # Parse file response
-    file_root = ET.fromstring(file_response)
+    def upload_with_buffered_log(item):
+        log = BufferedLogger(logger)
+        return upload_project_zip(api, item[0], item[1], log), log
 
-    if 'exception' in file_root.tag:
-        message_elem = file_root.find('.//{http://genologics.com/ri/exception}message')
-        if message_elem is None:
-            message_elem = file_root.find('.//message')
-        error_msg = message_elem.text if message_elem is not None else "Unknown error"
-        print(f"  ERROR creating file record: {error_msg}")
-        return None, None
+    uploaded_zips = []
+    with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+        # Each project's log lines are written together, in project order
+        for zip_info, log in executor.map(upload_with_buffered_log, project_zips.items()):
+            log.flush()
+            if zip_info is not None:
+                uploaded_zips.append(zip_info)
 
-    file_uri = file_root.get('uri')
-    file_limsid = file_root.get('limsid')
+    return uploaded_zips
 
-    if not file_uri:
-        print("  ERROR: Failed to get file URI from response")
-        return None, None
 
-    print(f"  Created file record: {file_limsid}")
+def debug_log_payload(xml_bytes):
+    """
+    Return an XML payload as text for the publish debug log, truncated to
+    MAX_DEBUG_LOG_PAYLOAD bytes. Undecodable bytes are replaced so logging can
+    never fail the publish.
+    """
+    if len(xml_bytes) <= MAX_DEBUG_LOG_PAYLOAD:
+        return xml_bytes.decode('utf-8', errors='replace')
+    truncated_bytes = len(xml_bytes) - MAX_DEBUG_LOG_PAYLOAD
+    return (xml_bytes[:MAX_DEBUG_LOG_PAYLOAD].decode('utf-8', errors='replace')
+            + f"...(truncated {truncated_bytes} bytes)")
 
-    # Step 3: Upload the actual file content using requests (multipart/form-data)
-    upload_url = f'{file_uri}/upload'
-    print(f"  Uploading file content to: {upload_url}")
 
-    # Create multipart form data
-    files_payload = {'file': (filename, io.BytesIO(file_data), 'application/zip')}
+def write_debug_log_section(debug_log, title, xml_bytes):
+    """Write one XML payload to the publish debug log, as sent or received (not re-serialized)."""
+    debug_log.write(f"{title}\n")
+    debug_log.write("-" * 80 + "\n")
+    debug_log.write(debug_log_payload(xml_bytes))
+    debug_log.write("\n" + "-" * 80 + "\n\n")
 
-    # Use the passed username and password
-    upload_response = requests.post(
-        upload_url,
-        files=files_payload,
-        auth=HTTPBasicAuth(username, password)
-    )
 
-    if upload_response.status_code == 200 or upload_response.status_code == 201:
-        print(f"  ✓ File uploaded successfully")
+def set_file_published(file_xml):
+    """
+    Set is-published to true in a file record XML.
+    Returns the updated XML bytes and the previous is-published value (None if
+    the record had no is-published element).
+    """
+    # An existing value is replaced in the raw bytes; the record is only parsed
+    # and re-serialized when the element has to be added
+    match = IS_PUBLISHED_VALUE_RE.search(file_xml)
+    if match is not None:
+        updated_xml = file_xml[:match.start(1)] + b'true' + file_xml[match.end(1):]
+        return updated_xml, match.group(1).decode('utf-8')
+
+    file_root = ET.fromstring(file_xml)
+    is_published_elem = file_root.find(IS_PUBLISHED_TAG)
+    old_value = None
+    if is_published_elem is None:
+        # Created WITHOUT namespace prefix, like the other child elements
+        is_published_elem = ET.SubElement(file_root, IS_PUBLISHED_TAG)
     else:
-        status_code = upload_response.status_code
-        response_text = upload_response.text
-        print(f"  ⚠ Upload status: {status_code}")
-        print(f"  Response: {response_text}")
-
-    return file_limsid, file_uri
+        old_value = is_published_elem.text or ''
+    is_published_elem.text = 'true'
+    return ET.tostring(file_root, encoding='utf-8'), old_value
 
 
-def upload_project_zips(api, username, password, project_zips):
+def publish_file_to_lablink(api, zip_info, debug_log_path, log=logger):
     """
-    Upload project zip files to their respective projects in Clarity LIMS.
+    Publish one uploaded project zip file to LabLink.
+    Returns a (published file info, debug log text) tuple; the published file
+    info is None if publishing failed. The debug log text is empty unless a
+    debug_log_path is given. Progress is logged to log (the module logger by default).
     """
-    uploaded_zips = []
+    project_name = zip_info['project_name']
+    project_limsid = zip_info['project_limsid']
+    file_limsid = zip_info['file_limsid']
+    file_uri = zip_info['file_uri']
+
+    # Debug log entries are collected per file and written out in order by the caller
+    debug_log = io.StringIO()
+
+    def write_debug_section(title, label, xml_bytes):
+        if debug_log_path is None:
+            return
+        write_debug_log_section(debug_log, title, xml_bytes)
+        log.info(f"  ({label} written to debug log, length: {len(xml_bytes)} bytes)")
+
+    log.info(f"\nPublishing file for project: {project_name} ({project_limsid})")
+    zip_filename = zip_info['zip_filename']
+    log.info(f"  File: {zip_filename}")
+    log.debug(f"  DEBUG: File URI: {file_uri}")
+    log.debug(f"  DEBUG: File LIMS ID: {file_limsid}")
 
-    print("\n" + "="*50)
-    print("UPLOADING ZIP FILES TO PROJECTS")
-    print("="*50)
+    try:
+        if debug_log_path is not None:
+            debug_log.write(f"\n{'='*80}\n")
+            debug_log.write(f"Publishing: {project_name} ({project_limsid})\n")
+            debug_log.write(f"File: {zip_filename}\n")
+            debug_log.write(f"File URI: {file_uri}\n")
+            debug_log.write(f"File LIMS ID: {file_limsid}\n")
+            debug_log.write(f"{'='*80}\n\n")
+
+        # Get the file XML to modify it
+        log.info(f"\n  === STEP 1: GET FILE XML ===")
+        # The file record returned when the file was created is reused when available
+        file_response = zip_info.get('file_xml')
+        if file_response is None:
+            log.debug(f"  DEBUG: Fetching file XML from {file_uri}")
+            file_response = api.GET(file_uri)
+        write_debug_section("STEP 1: ORIGINAL FILE XML", "Original XML", file_response)
 
-    for project_limsid, zip_info in project_zips.items():
-        project_name = zip_info['project_name']
-        project_uri = zip_info['project_uri']
-        zip_filename = zip_info['zip_filename']
-        zip_data = zip_info['zip_data']
-        file_count = zip_info['file_count']
+        # Add or update the is-published element
+        log.info(f"\n  === STEP 2: MODIFY XML ===")
+        updated_xml, old_value = set_file_published(file_response)
+        if old_value is not None:
+            log.debug(f"  DEBUG: Changed is-published text from '{old_value}' to 'true'")
+        else:
+            log.debug(f"  DEBUG: No is-published element found, created new one (no namespace prefix)")
+        log.debug(f"  DEBUG: Updated XML is {len(updated_xml)} bytes")
 
-        print(f"\nProject: {project_name} ({project_limsid})")
-        print(f"  Uploading: {zip_filename} ({file_count} files)")
+        write_debug_section("STEP 3: MODIFIED XML FOR PUT REQUEST", "Modified XML", updated_xml)
 
-        try:
-            file_limsid, file_uri = upload_file_to_project(
-                api,
-                project_uri,
-                zip_data,
-                zip_filename,
-                username,
-                password
-            )
-
-            if file_limsid and file_uri:
-                uploaded_zips.append({
+        # Show just the is-published element; set_file_published always writes one,
+        # so this is only a debugging aid
+        if log.isEnabledFor(logging.DEBUG):
+            is_pub_match = IS_PUBLISHED_VALUE_RE.search(updated_xml)
+            if is_pub_match is not None:
+                log.debug(f"  DEBUG: is-published in payload: {is_pub_match.group(0).decode('utf-8')}")
+            else:
+                log.warning(f"  WARNING: '<is-published>' not found in payload!")
+
+        # PUT the updated file back
+        log.info(f"\n  === STEP 4: SEND PUT REQUEST ===")
+        log.debug(f"  DEBUG: PUT URL: {file_uri}")
+        log.debug(f"  DEBUG: Payload size: {len(updated_xml)} bytes")
+        log.debug(f"  DEBUG: Sending PUT request...")
+
+        publish_response = api.PUT(updated_xml, file_uri)
+        log.debug(f"  DEBUG: PUT request completed, received response")
+
+        # Verify the response
+        log.info(f"\n  === STEP 5: PARSE PUT RESPONSE ===")
+        publish_root = ET.fromstring(publish_response)
+        log.debug(f"  DEBUG: Successfully parsed PUT response")
+        log.debug(f"  DEBUG: Response root tag: {publish_root.tag}")
+
+        write_debug_section("STEP 5: PUT RESPONSE XML", "Response XML", publish_response)
+
+        # Check for errors in response
+        if 'exception' in publish_root.tag:
+            log.error(f"\n  ERROR: Response is an exception!")
+            error_msg = publish_root.findtext(EXCEPTION_MESSAGE_TAG) or "Unknown error"
+            log.error(f"  ERROR: API returned exception: {error_msg}")
+            if debug_log_path is not None:
+                log.info(f"  (Full exception XML in debug log: {debug_log_path})")
+            return None, debug_log.getvalue()
+
+        # Check the is-published value in response
+        log.info(f"\n  === STEP 6: VERIFY PUBLICATION ===")
+        pub_value = publish_root.findtext(IS_PUBLISHED_TAG)
+        if pub_value is not None:
+            log.debug(f"  DEBUG: Response is-published value: '{pub_value}'")
+
+            if pub_value == 'true':
+                log.info(f"  ✓ Successfully published to LabLink")
+                published_file = {
                     'project_name': project_name,
                     'project_limsid': project_limsid,
-                    'project_uri': project_uri,
-                    'zip_filename': zip_filename,
                     'file_limsid': file_limsid,
-                    'file_uri': file_uri,
-                    'file_count': file_count
-                })
-
-                print(f"  ✓ Upload successful!")
+                    'zip_filename': zip_info['zip_filename'],
+                    'file_count': zip_info.get('file_count', 0)
+                }
+                return published_file, debug_log.getvalue()
             else:
-                print(f"  ✗ Failed: Could not create file record")
+                log.warning(f"  ⚠ Published but is-published = '{pub_value}' (expected 'true')")
+        else:
+            log.warning(f"  ⚠ Published but no is-published element in response")
+            if debug_log_path is not None:
+                log.info(f"  (Check debug log for full response XML: {debug_log_path})")
 
-        except Exception as e:
-            print(f"  ✗ Failed: {e}")
+    except Exception as e:
+        log.exception(f"\n  ✗ EXCEPTION during publish: {e}")
+        if debug_log_path is not None:
             import traceback
-            traceback.print_exc()
+            debug_log.write(f"\nEXCEPTION: {e}\n")
+            debug_log.write(traceback.format_exc())
+            debug_log.write("\n")
 
-    return uploaded_zips
+    return None, debug_log.getvalue()
 
 
-def publish_files_to_lablink(api, uploaded_zips):
+def batch_publish_files_to_lablink(api, uploaded_zips, debug_log):
     """
-    Publish uploaded files to LabLink.
+    Publish all uploaded project zip files to LabLink with a single files batch update.
+    Uses the file records returned when the files were created.
+    The files are read back afterwards to confirm each one is published.
+    Returns the list of published file info, or None if the batch update could not be
+    used (a file record is missing, Clarity rejected it or a file is not confirmed
+    published), so the caller can fall back to publishing the files one by one.
     """
-    print("\n" + "="*50)
-    print("PUBLISHING FILES TO LABLINK")
-    print("="*50)
+    if not uploaded_zips or any(zip_info.get('file_xml') is None for zip_info in uploaded_zips):
+        return None
 
-    published_files = []
+    # Each record keeps only its file:file element; an XML declaration mid-document
+    # would make the batch payload malformed
+    file_records = [XML_DECLARATION_RE.sub(b'', set_file_published(zip_info['file_xml'])[0])
+                    for zip_info in uploaded_zips]
 
-    # Create a debug log file in the sanger directory
-    import datetime
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    debug_log_path = f'/opt/gls/clarity/customextensions/sanger/lablink_publish_debug_{timestamp}.log'
-    print(f"\nDEBUG LOG FILE: {debug_log_path}")
+    details_payload = (b'<file:details xmlns:file="http://genologics.com/ri/file">'
+                       + b''.join(file_records) + b'</file:details>')
 
-    for zip_info in uploaded_zips:
-        project_name = zip_info['project_name']
-        project_limsid = zip_info['project_limsid']
-        file_limsid = zip_info['file_limsid']
-        file_uri = zip_info['file_uri']
+    base_uri = api.getApiURI()
+    batch_uri = f"{base_uri}/files/batch/update"
+    logger.info(f"\nPublishing {len(uploaded_zips)} files with one batch update: {batch_uri}")
 
-        print(f"\nPublishing file for project: {project_name} ({project_limsid})")
-        zip_filename = zip_info['zip_filename']
-        print(f"  File: {zip_filename}")
-        print(f"  DEBUG: File URI: {file_uri}")
-        print(f"  DEBUG: File LIMS ID: {file_limsid}")
+    try:
+        # Sent through the session directly so an HTTP error status is not mistaken for success
+        response = api.session.post(batch_uri, data=details_payload, headers=XML_HEADERS)
+        batch_response = response.content
+    except Exception as e:
+        logger.warning(f"  WARNING: Batch update failed ({e}); publishing files one by one")
+        return None
 
-        try:
-            with open(debug_log_path, 'a') as debug_log:
-                debug_log.write(f"\n{'='*80}\n")
-                debug_log.write(f"Publishing: {project_name} ({project_limsid})\n")
-                debug_log.write(f"File: {zip_filename}\n")
-                debug_log.write(f"File URI: {file_uri}\n")
-                debug_log.write(f"File LIMS ID: {file_limsid}\n")
-                debug_log.write(f"{'='*80}\n\n")
-
-            # Get the file XML to modify it
-            print(f"\n  === STEP 1: GET FILE XML ===")
-            print(f"  DEBUG: Fetching file XML from {file_uri}")
-            file_response = api.GET(file_uri)
-            file_root = ET.fromstring(file_response)
-            print(f"  DEBUG: Successfully parsed file XML")
-            print(f"  DEBUG: Root tag: {file_root.tag}")
-
-            # Write original XML to debug log
-            original_xml_str = ET.tostring(file_root, encoding='unicode')
-            with open(debug_log_path, 'a') as debug_log:
-                debug_log.write("STEP 1: ORIGINAL FILE XML\n")
-                debug_log.write("-" * 80 + "\n")
-                debug_log.write(original_xml_str)
-                debug_log.write("\n" + "-" * 80 + "\n\n")
-
-            print(f"  (Original XML written to debug log, length: {len(original_xml_str)} chars)")
-
-            # Check current is-published status
-            current_pub = file_root.find('.//is-published')
-            if current_pub is not None:
-                current_status = current_pub.text
-                print(f"\n  DEBUG: Current is-published value: '{current_status}'")
-            else:
-                print(f"\n  DEBUG: No is-published element found in current XML")
-
-            # Add or update the is-published element
-            print(f"\n  === STEP 2: MODIFY XML ===")
-
-            # Find the is-published element (checking both with and without namespace)
-            is_published_elem = file_root.find('.//is-published')
-
-            # Also try with the namespace
-            if is_published_elem is None:
-                namespace = file_root.tag.split('}')[0].strip('{') if '}' in file_root.tag else None
-                if namespace:
-                    is_published_elem = file_root.find('.//{%s}is-published' % namespace)
-
-            if is_published_elem is not None:
-                # Element exists, just change its text value
-                old_value = is_published_elem.text
-                is_published_elem.text = 'true'
-                print(f"  DEBUG: Found existing is-published element with value '{old_value}'")
-                print(f"  DEBUG: Changed is-published text from '{old_value}' to 'true'")
-            else:
-                # Element doesn't exist, create it WITHOUT namespace prefix
-                print(f"  DEBUG: No is-published element found, creating new one")
-                is_published_elem = ET.Element('is-published')
-                is_published_elem.text = 'true'
-                file_root.append(is_published_elem)
-                print(f"  DEBUG: Created and appended new is-published element (no namespace prefix)")
-
-            # Convert back to XML string
-            updated_xml = ET.tostring(file_root, encoding='utf-8')
-            print(f"  DEBUG: Converted to XML ({len(updated_xml)} bytes)")
-
-            # Write modified XML to debug log
-            updated_xml_str = updated_xml.decode('utf-8')
-            with open(debug_log_path, 'a') as debug_log:
-                debug_log.write("STEP 3: MODIFIED XML FOR PUT REQUEST\n")
-                debug_log.write("-" * 80 + "\n")
-                debug_log.write(updated_xml_str)
-                debug_log.write("\n" + "-" * 80 + "\n\n")
-
-            print(f"  (Modified XML written to debug log, length: {len(updated_xml_str)} chars)")
-
-            # Show just the is-published element
-            if '<is-published>' in updated_xml_str:
-                start_idx = updated_xml_str.find('<is-published>')
-                end_idx = updated_xml_str.find('</is-published>') + len('</is-published>')
-                is_pub_snippet = updated_xml_str[start_idx:end_idx]
-                print(f"  is-published in payload: {is_pub_snippet}")
-            else:
-                print(f"  WARNING: '<is-published>' not found in payload!")
-
-            # PUT the updated file back
-            print(f"\n  === STEP 4: SEND PUT REQUEST ===")
-            print(f"  DEBUG: PUT URL: {file_uri}")
-            print(f"  DEBUG: Payload size: {len(updated_xml)} bytes")
-            print(f"  DEBUG: Sending PUT request...")
-
-            publish_response = api.PUT(updated_xml, file_uri)
-            print(f"  DEBUG: PUT request completed, received response")
-
-            # Verify the response
-            print(f"\n  === STEP 5: PARSE PUT RESPONSE ===")
-            publish_root = ET.fromstring(publish_response)
-            print(f"  DEBUG: Successfully parsed PUT response")
-            print(f"  DEBUG: Response root tag: {publish_root.tag}")
-
-            # Write response XML to debug log
-            response_str = ET.tostring(publish_root, encoding='unicode')
-            with open(debug_log_path, 'a') as debug_log:
-                debug_log.write("STEP 5: PUT RESPONSE XML\n")
-                debug_log.write("-" * 80 + "\n")
-                debug_log.write(response_str)
-                debug_log.write("\n" + "-" * 80 + "\n\n")
-
-            print(f"  (Response XML written to debug log, length: {len(response_str)} chars)")
-
-            # Check for errors in response
-            if 'exception' in publish_root.tag:
-                print(f"\n  ERROR: Response is an exception!")
-                error_msg_elem = publish_root.find('.//{http://genologics.com/ri/exception}message')
-                if error_msg_elem is None:
-                    error_msg_elem = publish_root.find('.//message')
-                error_msg = error_msg_elem.text if error_msg_elem is not None else "Unknown error"
-                print(f"  ERROR: API returned exception: {error_msg}")
-                print(f"  (Full exception XML in debug log: {debug_log_path})")
-                continue
+    if debug_log is not None:
+        debug_log.write(f"\n{'='*80}\nBATCH UPDATE: {batch_uri}\n{'='*80}\n\n")
+        write_debug_log_section(debug_log, "BATCH UPDATE PAYLOAD", details_payload)
+        write_debug_log_section(debug_log, "BATCH UPDATE RESPONSE", batch_response)
 
-            # Check the is-published value in response
-            print(f"\n  === STEP 6: VERIFY PUBLICATION ===")
-            is_pub_elem = publish_root.find('.//is-published')
-            if is_pub_elem is not None:
-                pub_value = is_pub_elem.text
-                print(f"  DEBUG: Response is-published value: '{pub_value}'")
-
-                if pub_value == 'true':
-                    print(f"  ✓ Successfully published to LabLink")
-                    published_files.append({
-                        'project_name': project_name,
-                        'project_limsid': project_limsid,
-                        'file_limsid': file_limsid,
-                        'zip_filename': zip_info['zip_filename'],
-                        'file_count': zip_info.get('file_count', 0)
-                    })
-                else:
-                    print(f"  ⚠ Published but is-published = '{pub_value}' (expected 'true')")
-            else:
-                print(f"  ⚠ Published but no is-published element in response")
-                print(f"  (Check debug log for full response XML: {debug_log_path})")
+    try:
+        if EXCEPTION_NAMESPACE in batch_response:
+            raise ValueError(ET.fromstring(batch_response).findtext(EXCEPTION_MESSAGE_TAG) or "Unknown error")
+        if not response.ok:
+            raise ValueError(f"HTTP {response.status_code}")
+        # A successful update answers with a well-formed links document
+        ET.fromstring(batch_response)
+
+        # Read the files back and confirm every one of them is now published
+        details_root = batch_retrieve(api, 'files', [zip_info['file_uri'] for zip_info in uploaded_zips])
+        published_limsids = {file_elem.get('limsid') for file_elem in details_root.iter(FILE_TAG)
+                             if file_elem.findtext(IS_PUBLISHED_TAG) == 'true'}
+    except Exception as e:
+        logger.warning(f"  WARNING: Batch update rejected ({e}); publishing files one by one")
+        return None
+
+    unconfirmed = [zip_info['file_limsid'] for zip_info in uploaded_zips
+                   if zip_info['file_limsid'] not in published_limsids]
+    if unconfirmed:
+        logger.warning(f"  WARNING: Batch update did not publish {', '.join(unconfirmed)}; publishing files one by one")
+        return None
+
+    published_files = []
+    for zip_info in uploaded_zips:
+        logger.info(f"  ✓ Published {zip_info['zip_filename']} for project: {zip_info['project_name']} ({zip_info['project_limsid']})")
+        published_files.append({
+            'project_name': zip_info['project_name'],
+            'project_limsid': zip_info['project_limsid'],
+            'file_limsid': zip_info['file_limsid'],
+            'zip_filename': zip_info['zip_filename'],
+            'file_count': zip_info.get('file_count', 0)
+        })
 
-        except Exception as e:
-            print(f"\n  ✗ EXCEPTION during publish: {e}")
-            import traceback
-            traceback.print_exc()
-            with open(debug_log_path, 'a') as debug_log:
-                debug_log.write(f"\nEXCEPTION: {e}\n")
-                debug_log.write(traceback.format_exc())
-                debug_log.write("\n")
-
-    print(f"\n{'='*50}")
-    print(f"DEBUG: Total files successfully published: {len(published_files)}")
-    print(f"DEBUG LOG FILE: {debug_log_path}")
-    print(f"{'='*50}")
+    return published_files
+
+
+def publish_files_to_lablink(api, uploaded_zips):
+    """
+    Publish uploaded files to LabLink.
+    All files are published with one files batch update when possible; otherwise
+    each file is published independently, concurrently. With -v, the
+    request and response XML is also written to a debug log, once at the end and
+    in upload order.
+    """
+    logger.info("\n" + "="*50)
+    logger.info("PUBLISHING FILES TO LABLINK")
+    logger.info("="*50)
+
+    # Create a debug log file in the sanger directory, only when debugging
+    debug_log_path = None
+    if logger.isEnabledFor(logging.DEBUG):
+        import datetime
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        debug_log_path = f'/opt/gls/clarity/customextensions/sanger/lablink_publish_debug_{timestamp}.log'
+        logger.info(f"\nDEBUG LOG FILE: {debug_log_path}")
+
+    batch_debug_log = io.StringIO() if debug_log_path is not None else None
+    published_files = batch_publish_files_to_lablink(api, uploaded_zips, batch_debug_log)
+    debug_texts = [batch_debug_log.getvalue()] if batch_debug_log is not None else []
+
+    if published_files is None:
+        def publish_with_buffered_log(zip_info):
+            log = BufferedLogger(logger)
+            return publish_file_to_lablink(api, zip_info, debug_log_path, log) + (log,)
+
+        published_files = []
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+            # Each file's log lines are written together, in upload order
+            for published_file, debug_text, log in executor.map(publish_with_buffered_log, uploaded_zips):
+                log.flush()
+                if published_file is not None:
+                    published_files.append(published_file)
+                debug_texts.append(debug_text)
+
+    if debug_log_path is not None:
+        with open(debug_log_path, 'a') as debug_log:
+            debug_log.writelines(debug_texts)
+
+    logger.info(f"\n{'='*50}")
+    logger.debug(f"DEBUG: Total files successfully published: {len(published_files)}")
+    if debug_log_path is not None:
+        logger.info(f"DEBUG LOG FILE: {debug_log_path}")
+    logger.info(f"{'='*50}")
     return published_files
 
 
 def get_researcher_email_from_project(api, project_uri):
     """Get the researcher's email address from the project."""
     try:
-        print(f"  DEBUG: Getting researcher email from project: {project_uri}")
+        logger.debug(f"  DEBUG: Getting researcher email from project: {project_uri}")
 
-        # Get the project
-        project_response = api.GET(project_uri)
-        project_root = ET.fromstring(project_response)
+        # Get the project (usually already fetched while matching artifacts)
+        project_root = get_project_root(api, project_uri)
 
-        # Find the researcher element
-        researcher_elem = project_root.find('.//researcher')
-        if researcher_elem is None:
-            print(f"  WARNING: No researcher found in project")
-            return None
-
-        researcher_uri = researcher_elem.get('uri')
+        # Find the researcher link (a direct child of the project)
+        researcher_elem = project_root.find(RESEARCHER_LINK_PATH)
+        researcher_uri = researcher_elem.get('uri') if researcher_elem is not None else None
         if not researcher_uri:
-            print(f"  WARNING: No researcher URI found")
+            logger.warning(f"  WARNING: No researcher URI found in project")
             return None
 
-        print(f"  DEBUG: Found researcher URI: {researcher_uri}")
+        logger.debug(f"  DEBUG: Found researcher URI: {researcher_uri}")
 
         # Get the researcher details
         researcher_response = api.GET(researcher_uri)
         researcher_root = ET.fromstring(researcher_response)
 
         # Find the email element
-        email_elem = researcher_root.find('.//email')
-        if email_elem is None or email_elem.text is None:
-            print(f"  WARNING: No email found for researcher")
+        email = researcher_root.findtext(EMAIL_TAG)
+        if not email:
+            logger.warning(f"  WARNING: No email found for researcher")
             return None
 
-        email = email_elem.text
-        print(f"  DEBUG: Found researcher email: {email}")
+        logger.debug(f"  DEBUG: Found researcher email: {email}")
         return email
 
     except Exception as e:
-        print(f"  ERROR: Exception getting researcher email: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"  ERROR: Exception getting researcher email: {e}")
         return None
 
 
+def get_researcher_emails(api, projectURIs):
+    """
+    Get the researcher email for each of the given projects. Each lookup takes two
+    GETs (project, then researcher), so the projects are looked up concurrently.
+    Returns a dict mapping project URI to email (None if it could not be found).
+    """
+    with ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS) as executor:
+        return dict(zip(projectURIs, executor.map(
+            lambda project_uri: get_researcher_email_from_project(api, project_uri),
+            projectURIs
+        )))
+
+
 def get_sample_names_from_project(api, project_uri):
     """Get all sample names associated with a project."""
     try:
-        print(f"  DEBUG: Getting sample names from project: {project_uri}")
+        logger.debug(f"  DEBUG: Getting sample names from project: {project_uri}")
 
-        # Get the project
-        project_response = api.GET(project_uri)
-        project_root = ET.fromstring(project_response)
+        # Get the project (usually already fetched while matching artifacts)
+        project_root = get_project_root(api, project_uri)
 
         # Get the project LIMS ID to query samples
         project_limsid = project_root.get('limsid')
 
-        # Query for samples in this project
-        base_uri = api.getBaseURI().rstrip('/')
-        samples_uri = f"{base_uri}/api/v2/samples?projectlimsid={project_limsid}"
-
-        print(f"  DEBUG: Querying samples: {samples_uri}")
-        samples_response = api.GET(samples_uri)
-        samples_root = ET.fromstring(samples_response)
+        # Query for samples in this project (the base URI already ends in /api/v2)
+        base_uri = api.getApiURI()
+        samples_uri = f"{base_uri}/samples?projectlimsid={project_limsid}"
+
+        # The sample list only links to each sample; stream it so large projects
+        # are not held as a whole tree. Long lists are split into pages, each
+        # linking to the next one.
+        sample_uris = []
+        while samples_uri:
+            logger.debug(f"  DEBUG: Querying samples: {samples_uri}")
+            samples_response = api.GET(samples_uri)
+            samples_uri = None
+
+            for _, list_elem in ET.iterparse(io.BytesIO(samples_response), **SAMPLE_LIST_ITERPARSE_ARGS):
+                if list_elem.tag == SAMPLE_LINK_TAG:
+                    sample_uris.append(list_elem.get('uri'))
+                elif list_elem.tag == NEXT_PAGE_TAG:
+                    samples_uri = list_elem.get('uri')
+                else:
+                    continue
+                release_parsed_element(list_elem)
 
-        # Extract sample names
+        # Extract sample names, retrieving all the samples in one batch call
         sample_names = []
-        for sample_elem in samples_root.findall('.//sample'):
-            name_elem = sample_elem.find('.//name')
-            if name_elem is not None and name_elem.text:
-                sample_names.append(name_elem.text)
+        if sample_uris:
+            details_root = batch_retrieve(api, 'samples', sample_uris)
+            sample_names = [sample_name for sample_name in find_sample_names(details_root) if sample_name]
 
-        print(f"  DEBUG: Found {len(sample_names)} samples")
+        logger.debug(f"  DEBUG: Found {len(sample_names)} samples")
         return sample_names
 
     except Exception as e:
-        print(f"  ERROR: Exception getting sample names: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"  ERROR: Exception getting sample names: {e}")
         return []
 
 
-def send_notification_email(api, published_file_info, projects):
-    """Send email notification to researcher about published files."""
+def send_notification_email(api, published_file_info, projects, researcher_emails=None, smtp=None):
+    """
+    Send email notification to researcher about published files.
+    researcher_emails, if given, is a dict of project URI to researcher email
+    looked up in advance by get_researcher_emails. smtp, if given, is an open
+    SMTP connection shared by all notifications (reconnected if the server drops
+    it); otherwise one is opened for this email.
+    """
     project_name = published_file_info['project_name']
     project_limsid = published_file_info['project_limsid']
     zip_filename = published_file_info['zip_filename']
@@ -985,37 +1529,25 @@ def send_notification_email(api, published_file_info, projects):
     # Get project URI from the projects dict
     project_data = projects.get(project_limsid)
     if not project_data:
-        print(f"  ERROR: Could not find project data for {project_limsid}")
+        logger.error(f"  ERROR: Could not find project data for {project_limsid}")
         return False
 
     project_uri = project_data['project_uri']
 
-    print(f"\n  Preparing email notification for project: {project_name}")
+    logger.info(f"\n  Preparing email notification for project: {project_name}")
 
     # Get researcher email
-    researcher_email = get_researcher_email_from_project(api, project_uri)
+    if researcher_emails is not None and project_uri in researcher_emails:
+        researcher_email = researcher_emails[project_uri]
+    else:
+        researcher_email = get_researcher_email_from_project(api, project_uri)
     if not researcher_email:
-        print(f"  ERROR: Could not get researcher email, skipping notification")
+        logger.error(f"  ERROR: Could not get researcher email, skipping notification")
         return False
 
     # Get sample names from project files
     sample_names = [f['artifact_name'] for f in project_data['files']]
 
-    # Read email templates
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    html_template_path = os.path.join(script_dir, 'templates', 'sequencing_files_notification.html')
-    text_template_path = os.path.join(script_dir, 'templates', 'sequencing_files_notification.txt')
-
-    try:
-        with open(html_template_path, 'r') as f:
-            html_template_content = f.read()
-
-        with open(text_template_path, 'r') as f:
-            text_template_content = f.read()
-    except Exception as e:
-        print(f"  ERROR: Could not read email templates: {e}")
-        return False
-
     # Render templates with Jinja2
     template_vars = {
         'project_name': project_name,
@@ -1026,45 +1558,55 @@ def send_notification_email(api, published_file_info, projects):
     }
 
     try:
-        html_template = Template(html_template_content)
-        text_template = Template(text_template_content)
+        html_template = TEMPLATE_ENV.get_template('sequencing_files_notification.html')
+        text_template = TEMPLATE_ENV.get_template('sequencing_files_notification.txt')
 
         html_body = html_template.render(**template_vars)
         text_body = text_template.render(**template_vars)
     except Exception as e:
-        print(f"  ERROR: Could not render email templates: {e}")
+        logger.error(f"  ERROR: Could not render email templates: {e}")
         return False
 
     # Create email message
-    msg = MIMEMultipart('alternative')
+    msg = EmailMessage()
     msg['Subject'] = f'Sequencing Files Available - {project_name}'
     msg['From'] = 'noreply@clarity.lims'
     msg['To'] = researcher_email
 
-    # Attach both plain text and HTML versions
-    text_part = MIMEText(text_body, 'plain')
-    html_part = MIMEText(html_body, 'html')
-    msg.attach(text_part)
-    msg.attach(html_part)
+    # Plain text version, with the HTML version as the preferred alternative
+    msg.set_content(text_body)
+    msg.add_alternative(html_body, subtype='html')
 
     # Send email via localhost SMTP
     try:
-        print(f"  Sending email to: {researcher_email}")
-        with smtplib.SMTP('localhost', 25) as smtp:
-            smtp.send_message(msg)
-        print(f"  ✓ Email sent successfully to {researcher_email}")
+        logger.info(f"  Sending email to: {researcher_email}")
+        if smtp is not None:
+            try:
+                smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The shared connection was dropped (e.g. server idle timeout or
+                # message limit); reconnect it once and retry this email
+                logger.warning(f"  WARNING: Mail server closed the connection, reconnecting")
+                smtp.close()
+                smtp.connect(SMTP_HOST, SMTP_PORT)
+                smtp.ehlo()
+                smtp.send_message(msg)
+        else:
+            with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as own_smtp:
+                own_smtp.send_message(msg)
+        logger.info(f"  ✓ Email sent successfully to {researcher_email}")
         return True
     except Exception as e:
-        print(f"  ERROR: Could not send email: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"  ERROR: Could not send email: {e}")
         return False
 
 
 def main():
     args = setupArguments()
+    setupLogging(args.logfileName, args.verbose)
     args.base_uri = args.base_uri.strip('/api/v2')
-    api = glsapiutil3.glsapiutil3()
+    session = create_session(args.username, args.password)
+    api = PooledClarityAPI(session)
     api.setHostname(args.base_uri)
     api.setup(args.username, args.password)
 
@@ -1072,95 +1614,117 @@ def main():
     fileURI = locatedZip(api, 'Zipped Run Folder', args.stepURI, args.base_uri)
 
     if not fileURI:
-        print("ERROR: Could not find zip file")
+        logger.error("ERROR: Could not find zip file")
         return None
 
-    print(f"\nDownloading zip file...")
-    myZIP = downloadZip(api, fileURI)
+    logger.info(f"\nDownloading zip file...")
+    myZIP = downloadZip(session, fileURI)
 
     # Extract all files, grouped by base name (ignoring extensions)
-    files_by_basename, all_files_data = interact_with_ab1_files(myZIP)
+    files_by_basename = interact_with_ab1_files(myZIP)
 
     # Get artifacts and match (now includes project info)
-    print("\nGetting step artifacts...")
+    logger.info("\nGetting step artifacts...")
     stepArtifacts = get_step_artifacts(api, args.stepURI)
 
     matches = match_artifacts_to_files(api, stepArtifacts, files_by_basename)
 
     # Group matches by project
-    print("\n" + "="*50)
-    print("GROUPING FILES BY PROJECT")
-    print("="*50)
+    logger.info("\n" + "="*50)
+    logger.info("GROUPING FILES BY PROJECT")
+    logger.info("="*50)
     projects = group_matches_by_project(matches)
 
     if not projects:
-        print("ERROR: No projects found with matched files")
+        logger.error("ERROR: No projects found with matched files")
         myZIP.close()
         return None
 
-    print(f"\nFound {len(projects)} project(s) with files:")
+    logger.info(f"\nFound {len(projects)} project(s) with files:")
     for project_limsid, project_data in projects.items():
         project_name = project_data['project_name']
         file_count = len(project_data['files'])
-        print(f"  {project_name} ({project_limsid}): {file_count} file(s)")
+        logger.info(f"  {project_name} ({project_limsid}): {file_count} file(s)")
 
     # Create zip files for each project
-    project_zips = create_project_zip_files(projects)
+    project_zips = create_project_zip_files(myZIP, projects)
 
     # Upload zip files to projects
-    uploaded_zips = upload_project_zips(api, args.username, args.password, project_zips)
+    uploaded_zips = upload_project_zips(api, project_zips)
 
     # Publish files to LabLink
     published_files = publish_files_to_lablink(api, uploaded_zips)
 
     # Send email notifications for published files
-    print("\n" + "="*50)
-    print("SENDING EMAIL NOTIFICATIONS")
-    print("="*50)
+    logger.info("\n" + "="*50)
+    logger.info("SENDING EMAIL NOTIFICATIONS")
+    logger.info("="*50)
+
+    # Look up all researcher emails up front, concurrently, instead of one project at a time
+    researcher_emails = get_researcher_emails(api, list(dict.fromkeys(
+        projects[published_file['project_limsid']]['project_uri']
+        for published_file in published_files
+        if published_file['project_limsid'] in projects
+    )))
 
     emails_sent = 0
     emailed_projects = set()
-    for published_file in published_files:
+
+    # All notifications are sent over one SMTP connection; if it cannot be opened,
+    # each email falls back to its own connection
+    smtp = None
+    if published_files:
         try:
-            success = send_notification_email(api, published_file, projects)
-            if success:
-                emails_sent += 1
-                emailed_projects.add(published_file['project_limsid'])
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
         except Exception as e:
-            project_name = published_file['project_name']
-            print(f"  ERROR: Failed to send email for {project_name}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.warning(f"  WARNING: Could not connect to mail server {SMTP_HOST}:{SMTP_PORT}: {e}")
 
-    print(f"\n{'='*50}")
-    print(f"Total email notifications sent: {emails_sent}/{len(published_files)}")
-    print(f"{'='*50}")
+    try:
+        for published_file in published_files:
+            try:
+                success = send_notification_email(api, published_file, projects, researcher_emails, smtp)
+                if success:
+                    emails_sent += 1
+                    emailed_projects.add(published_file['project_limsid'])
+            except Exception as e:
+                project_name = published_file['project_name']
+                logger.exception(f"  ERROR: Failed to send email for {project_name}: {e}")
+    finally:
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                smtp.close()
+
+    logger.info(f"\n{'='*50}")
+    logger.info(f"Total email notifications sent: {emails_sent}/{len(published_files)}")
+    logger.info(f"{'='*50}")
 
     # Summary
-    print("\n" + "="*50)
-    print("FINAL SUMMARY")
-    print("="*50)
-    print(f"Total projects processed: {len(projects)}")
-    print(f"Total zip files created: {len(project_zips)}")
-    print(f"Total zip files uploaded: {len(uploaded_zips)}")
-    print(f"Total files published to LabLink: {len(published_files)}")
-    print(f"Total email notifications sent: {emails_sent}")
-
-    print("\nDetails:")
+    logger.info("\n" + "="*50)
+    logger.info("FINAL SUMMARY")
+    logger.info("="*50)
+    logger.info(f"Total projects processed: {len(projects)}")
+    logger.info(f"Total zip files created: {len(project_zips)}")
+    logger.info(f"Total zip files uploaded: {len(uploaded_zips)}")
+    logger.info(f"Total files published to LabLink: {len(published_files)}")
+    logger.info(f"Total email notifications sent: {emails_sent}")
+
+    logger.info("\nDetails:")
     for zip_info in uploaded_zips:
         project_name = zip_info['project_name']
         project_limsid = zip_info['project_limsid']
         zip_filename = zip_info['zip_filename']
         file_count = zip_info['file_count']
         file_limsid = zip_info['file_limsid']
-        print(f"\n  Project: {project_name} ({project_limsid})")
-        print(f"    Zip file: {zip_filename}")
-        print(f"    Files in zip: {file_count}")
-        print(f"    File LIMS ID: {file_limsid}")
+        logger.info(f"\n  Project: {project_name} ({project_limsid})")
+        logger.info(f"    Zip file: {zip_filename}")
+        logger.info(f"    Files in zip: {file_count}")
+        logger.info(f"    File LIMS ID: {file_limsid}")
         published = any(p['file_limsid'] == file_limsid for p in published_files)
-        print(f"    Published to LabLink: {'Yes' if published else 'No'}")
+        logger.info(f"    Published to LabLink: {'Yes' if published else 'No'}")
         email_sent = project_limsid in emailed_projects
-        print(f"    Email notification sent: {'Yes' if email_sent else 'No'}")
+        logger.info(f"    Email notification sent: {'Yes' if email_sent else 'No'}")
 
     myZIP.close()
 
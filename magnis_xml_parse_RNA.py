@@ -1,4 +1,7 @@
-import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 from xml.dom.minidom import parseString
 import requests
 import os
@@ -796,21 +799,22 @@ def download_xml_from_clarity(fileLuid):
                 xmlFileName = f"MagnisRunInfo_{fileLuid}.xml"
                 print(f"WARNING: Could not find original filename, using: {xmlFileName}")
 
-            # Decode the downloaded content
+            # Keep the downloaded content as bytes so ElementTree can parse it
+            # directly, without a decode and re-encode
             if isinstance(downloadedxml, bytes):
-                xml_data = downloadedxml.decode('utf-8')
+                xml_data = downloadedxml
             else:
-                xml_data = str(downloadedxml)
+                xml_data = str(downloadedxml).encode('utf-8')
             
             print('XML Data downloaded successfully')
             print(f'Data length: {len(xml_data)} bytes')
             
             # Verify it looks like XML
-            if xml_data.strip().startswith('<?xml') or xml_data.strip().startswith('<RunInfo'):
+            if xml_data.strip().startswith((b'<?xml', b'<RunInfo')):
                 print('✓ Content appears to be valid XML')
             else:
                 print('⚠ WARNING: Content may not be valid XML')
-                print(f'First 200 chars: {xml_data[:200]}')
+                print(f"First 200 chars: {xml_data[:200].decode('utf-8', 'replace')}")
             
             return xml_data, xmlFileName
         else:
@@ -1263,9 +1267,9 @@ def main():
         sys.exit(1)
     
     # Verify XML is valid before parsing
-    if not (xml_data.strip().startswith('<?xml') or xml_data.strip().startswith('<RunInfo')):
+    if not xml_data.strip().startswith((b'<?xml', b'<RunInfo')):
         print("\nERROR: Downloaded content is not valid XML")
-        print(f"Content preview (first 500 chars):\n{xml_data[:500]}")
+        print(f"Content preview (first 500 chars):\n{xml_data[:500].decode('utf-8', 'replace')}")
         sys.exit(1)
     
     print(f"\n✓ Successfully downloaded: {xml_file_name}")
@@ -1278,7 +1282,7 @@ def main():
         print(f"\nERROR: Failed to parse Magnis XML: {e}")
         import traceback
         traceback.print_exc()
-        print(f"\nXML content preview:\n{xml_data[:1000]}")
+        print(f"\nXML content preview:\n{xml_data[:1000].decode('utf-8', 'replace')}")
         sys.exit(1)
     
     # Verify we got valid data
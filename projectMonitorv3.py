@@ -14,7 +14,10 @@ import traceback
 import os
 from datetime import datetime
 from typing import Set, Optional
-from xml.etree import ElementTree as ET
+try:
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
 
 # Import Clarity API utilities
 import glsapiutil3
@@ -51,6 +54,13 @@ NSMAP = {
     'ri': 'http://genologics.com/ri'
 }
 
+# UDF lookup run against every project on every check; compiled once when lxml is available
+if hasattr(ET, 'XPath'):
+    find_udf_fields = ET.XPath('.//udf:field', namespaces=NSMAP)
+else:
+    def find_udf_fields(element):
+        return element.findall('.//udf:field', NSMAP)
+
 def researcher_email_template(researcher_firstName, project_name ):
     body = []
     body.append(f"Dear {researcher_firstName}")
@@ -176,7 +186,7 @@ class ClarityProjectMonitor:
             return True
         
         # Check UDF flag
-        for udf in project_xml.findall('.//udf:field', NSMAP):
+        for udf in find_udf_fields(project_xml):
             if udf.get('name') == UDF_PROCESSED and udf.text == 'YES':
                 self.processed_projects.add(project_id)
                 return True
@@ -212,7 +222,7 @@ class ClarityProjectMonitor:
         
         # Extract UDFs
         info['udfs'] = {}
-        for udf in project_xml.findall('.//udf:field', NSMAP):
+        for udf in find_udf_fields(project_xml):
             udf_name = udf.get('name')
             
             udf_value = udf.text
@@ -316,7 +326,7 @@ class ClarityProjectMonitor:
         """Set or update a UDF value in the project XML."""
         # Find existing UDF or create new one
         udf_found = False
-        for udf in project_xml.findall('.//udf:field', NSMAP):
+        for udf in find_udf_fields(project_xml):
             if udf.get('name') == udf_name:
                 udf.text = udf_value
                 udf_found = True